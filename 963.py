@@ -2,12 +2,16 @@
 
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+import numpy as np
 import plotly.graph_objects as go # 导入 graph_objects 以便更精细地控制图表
 import finnhub
 import yfinance as yf
+from requests.adapters import HTTPAdapter
+import json
+import shutil
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 
 # ------------------ 页面配置 (Page Configuration) ------------------
 st.set_page_config(
@@ -27,11 +31,32 @@ st.markdown("""
 # ------------------ 配置和常量 (Configuration & Constants) ------------------
 
 # --- API密钥配置 ---
-try:
-    API_KEY = st.secrets["FINNHUB_API_KEY"]
-    client = finnhub.Client(api_key=API_KEY)
-except KeyError:
-    client = None
+# 每次取数时读取密钥，不放进缓存，这样之后补充或轮换的密钥无需重启即可生效
+def get_api_key():
+    try:
+        return st.secrets["FINNHUB_API_KEY"]
+    except (KeyError, FileNotFoundError): # 缺少该密钥或整个 secrets.toml 文件
+        return None
+
+# 客户端内部持有 requests.Session，按密钥缓存以便跨重跑复用 HTTP 长连接；密钥变化时会构建新的客户端
+@st.cache_resource
+def get_finnhub_client(api_key):
+    client = finnhub.Client(api_key=api_key)
+    # requests 默认每个主机只保留 10 个连接，少于并发报价线程数；扩大连接池让每个线程都能复用长连接
+    # 注意 _session 是 finnhub.Client 的私有属性，若新版本改名则保留默认连接池
+    session = getattr(client, '_session', None)
+    if session is not None:
+        session.mount('https://', HTTPAdapter(pool_connections=len(SECTOR_ETFS), pool_maxsize=len(SECTOR_ETFS)))
+    return client
+
+# 本地磁盘缓存目录：相对于应用文件而非启动目录，且只使用本应用专属的子目录
+CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "nsd"
+QUOTE_CACHE_DIR = CACHE_DIR / "finnhub"
+VOLUME_CACHE_DIR = CACHE_DIR / "yf"
+
+# 报价与成交量的有效期（秒），只由磁盘缓存的写入时间判断，不再叠加进程内缓存
+QUOTE_TTL = 60
+VOLUME_TTL = 300
 
 # 板块ETF映射
 SECTOR_ETFS = {
@@ -50,122 +75,188 @@ SECTOR_ETFS = {
 
 # ------------------ 核心数据获取函数 ------------------
 
-@st.cache_data(ttl=60)
+# 线程池跨重跑复用，避免每次取数都新建线程
+@st.cache_resource
+def get_quote_executor():
+    return ThreadPoolExecutor(max_workers=len(SECTOR_ETFS))
+
+def get_quote_cached(client, ticker, ttl=QUOTE_TTL):
+    # 按代码落盘的短时报价缓存，跨会话和重启共享，是报价唯一的缓存层
+    cache_path = QUOTE_CACHE_DIR / f"{ticker}.json"
+    try:
+        entry = json.loads(cache_path.read_text())
+        if time.time() - entry['ts'] < ttl: return entry['quote']
+    except (OSError, ValueError, KeyError): pass
+    quote = client.quote(ticker)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps({'ts': time.time(), 'quote': quote}))
+    except OSError: pass
+    return quote
+
 def get_realtime_performance_data(etfs):
-    if client is None: return pd.DataFrame()
-    performance_data = []
-    for sector, ticker in etfs.items():
+    api_key = get_api_key()
+    if api_key is None or not etfs: return pd.DataFrame()
+    client = get_finnhub_client(api_key)
+    sectors, tickers, prices, deltas, pcts = [], [], [], [], []
+    # 各 ETF 的报价请求互不依赖，并发发出以免逐个等待网络往返
+    executor = get_quote_executor()
+    futures = {executor.submit(get_quote_cached, client, ticker): (sector, ticker) for sector, ticker in etfs.items()}
+    for future in as_completed(futures):
+        sector, ticker = futures[future]
         try:
-            quote = client.quote(ticker)
+            quote = future.result()
             if quote.get('c') is not None and quote.get('c') != 0:
-                performance_data.append({
-                    "板块": sector, "代码": ticker, "当前价格": quote.get('c', 0),
-                    "涨跌额": quote.get('d', 0), "涨跌幅 (%)": quote.get('dp', 0),
-                })
+                sectors.append(sector); tickers.append(ticker); prices.append(quote.get('c', 0))
+                deltas.append(quote.get('d', 0)); pcts.append(quote.get('dp', 0))
         except Exception: pass
-    return pd.DataFrame(performance_data)
+    return pd.DataFrame({
+        "板块": sectors, "代码": tickers, "当前价格": prices,
+        "涨跌额": deltas, "涨跌幅 (%)": pcts,
+    })
+
+def read_disk_cache(path, ttl):
+    try:
+        if time.time() - path.stat().st_mtime < ttl: return pd.read_parquet(path)
+    except (OSError, ValueError): pass
+    return None
+
+def write_disk_cache(df, path):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(path, compression='snappy')
+    except OSError: pass
 
-@st.cache_data(ttl=300)
 def get_today_volume_yf(etfs):
     if not etfs: return pd.DataFrame()
     ticker_list = list(etfs.values())
+    # 落盘缓存跨会话和重启共享，是成交量唯一的缓存层；每组代码固定一个文件，由 mtime 判断新鲜度
+    cache_path = VOLUME_CACHE_DIR / f"{'_'.join(sorted(ticker_list))}.parquet"
+    cached = read_disk_cache(cache_path, ttl=VOLUME_TTL)
+    if cached is not None: return cached
     try:
-        data = yf.download(ticker_list, period="1d", progress=False)
+        data = yf.download(ticker_list, period="1d", group_by='column', threads=True, progress=False)
         if data.empty: return pd.DataFrame()
-        
-        if len(ticker_list) == 1:
-            volume_series = data['Volume']
-        else:
-            volume_series = data['Volume'].iloc[-1] if not data['Volume'].empty else data['Volume']
-            
-        volume_data = volume_series.reset_index()
-        volume_data.columns = ['代码', '成交量']
+
+        # 所有代码一次批量下载；单个代码时旧版 yfinance 返回 Series，统一为按代码分列的表
+        volume_frame = data['Volume']
+        if isinstance(volume_frame, pd.Series):
+            volume_frame = volume_frame.to_frame(name=ticker_list[0])
+
+        volume_data = volume_frame.iloc[-1].rename_axis('代码').reset_index(name='成交量')
+        write_disk_cache(volume_data, cache_path)
         return volume_data
     except Exception:
         return pd.DataFrame()
 
+# ------------------ 图表构建函数 ------------------
+
+# 以 (板块, 涨跌幅, 文本) 元组为键缓存 Figure 对象本身，输入未变时直接复用，无需重建或反序列化
+@st.cache_resource(max_entries=16)
+def build_perf_bar(chart_rows):
+    sectors, pcts, texts = (np.asarray(col) for col in zip(*chart_rows))
+
+    # [核心修改] 使用更强大的 go.Figure() 来创建图表，以实现更精细的控制
+    fig_bar = go.Figure()
+
+    # 上涨和下跌的板块各用一个条形轨迹（insidetextanchor 不支持按条设置，因此按方向分组）
+    is_positive = pcts >= 0
+    for mask, color, anchor in ((is_positive, 'green', 'end'), (~is_positive, 'red', 'start')):
+        if not mask.any(): continue
+
+        fig_bar.add_trace(go.Bar(
+            y=sectors[mask],
+            x=pcts[mask],
+            orientation='h',
+            marker_color=color,
+            text=texts[mask],
+            textposition='inside', # 文本位置在条形内部
+            textfont=dict(color='white'),
+            insidetextanchor=anchor # 上涨时文本靠右，下跌时文本靠左
+        ))
+
+    # [核心修改] 更新图表布局
+    fig_bar.update_layout(
+        title_text="各板块实时涨跌幅与成交量对比",
+        showlegend=False,
+        barmode='stack', # 确保条形图正确堆叠（虽然这里只有一个）
+        yaxis={'categoryorder':'total ascending'},
+        xaxis_title="涨跌幅 (%)",
+        yaxis_title="板块",
+        margin=dict(l=150, r=20, t=80, b=50) # 优化边距
+    )
+    return fig_bar
+
 # ------------------ 侧边栏和用户输入 ------------------
 with st.sidebar:
     st.header("⚙️ 参数设置")
     all_sectors = list(SECTOR_ETFS.keys())
     selected_sectors = st.multiselect("选择要监控的板块", options=all_sectors, default=all_sectors)
-    if st.checkbox("自动刷新（每分钟）"): time.sleep(60); st.rerun()
-    if st.button("🔄 手动刷新"): st.cache_data.clear(); st.rerun()
+    auto_refresh = st.checkbox("自动刷新（每分钟）")
+    if st.button("🔄 手动刷新"):
+        for cache_dir in (QUOTE_CACHE_DIR, VOLUME_CACHE_DIR): shutil.rmtree(cache_dir, ignore_errors=True)
+        st.rerun()
 
-# ------------------ 数据获取与处理 ------------------
-etfs_to_fetch = {sector: SECTOR_ETFS[sector] for sector in selected_sectors if sector in SECTOR_ETFS}
+# 未选择任何板块时无需取数和绘图，直接提示并结束本次运行
+if not selected_sectors:
+    st.info("请在侧边栏选择至少一个板块。")
+    st.stop()
 
-with st.spinner('正在加载实时数据...'):
-    df_performance = get_realtime_performance_data(etfs_to_fetch)
-    df_volume = get_today_volume_yf(etfs_to_fetch)
+# ------------------ 数据获取与处理 ------------------
 
-# ------------------ 页面展示 ------------------
+# 自动刷新只按间隔重跑实时行情片段，不阻塞脚本线程，也不重跑侧边栏
+@st.fragment(run_every=60 if auto_refresh else None)
+def render_realtime(selected_sectors):
+    with st.spinner('正在加载实时数据...'):
+        # 始终按全部板块取数，缓存键保持不变；切换所选板块只在内存中筛选，不会重新请求
+        df_performance = get_realtime_performance_data(SECTOR_ETFS)
+        df_volume = get_today_volume_yf(SECTOR_ETFS)
+        if not df_performance.empty:
+            df_performance = df_performance[df_performance['板块'].isin(selected_sectors)]
 
-if df_performance.empty:
-    st.error("无法加载实时行情数据。请检查您的 Finnhub API 密钥是否已正确配置。")
-else:
-    if not df_volume.empty:
-        df_merged = pd.merge(df_performance, df_volume, on="代码", how="left")
+    # 页面展示
+    if df_performance.empty:
+        st.error("无法加载实时行情数据。请检查您的 Finnhub API 密钥是否已正确配置。")
     else:
-        df_merged = df_performance
-        df_merged['成交量'] = 0
-    df_merged['成交量'] = df_merged['成交量'].fillna(0)
-
-    def format_volume(v):
-        if v is None or pd.isna(v) or v == 0: return "N/A"
-        if v > 1_000_000: return f"{v / 1_000_000:.2f}M"
-        if v > 1_000: return f"{v / 1_000:.2f}K"
-        return str(int(v))
-        
-    df_merged['chart_text'] = df_merged.apply(
-        lambda row: f" {row['涨跌幅 (%)']:.2f}% (成交量: {format_volume(row['成交量'])}) " if row['涨跌幅 (%)'] >= 0 else f" {row['涨跌幅 (%)']:.2f}% (成交量: {format_volume(row['成交量'])}) ",
-        axis=1
-    )
+        if not df_volume.empty:
+            df_merged = df_performance.set_index('代码').join(df_volume.set_index('代码'), how='left', validate='1:1').reset_index()
+        else:
+            df_merged = df_performance
+            df_merged['成交量'] = 0
+        df_merged['成交量'] = df_merged['成交量'].fillna(0)
+
+        def format_volume(volumes):
+            volumes = np.asarray(volumes, dtype=float)
+            scales = np.select([volumes > 1_000_000, volumes > 1_000], [1_000_000, 1_000], default=1)
+            suffixes = np.select([volumes > 1_000_000, volumes > 1_000], ['M', 'K'], default='')
+            return [
+                "N/A" if np.isnan(v) or v == 0 else f"{v / scale:.2f}{suffix}" if suffix else str(int(v))
+                for v, scale, suffix in zip(volumes, scales, suffixes)
+            ]
+
+        df_merged['chart_text'] = [
+            f" {pct:.2f}% (成交量: {volume_text}) "
+            for pct, volume_text in zip(df_merged['涨跌幅 (%)'].to_numpy(), format_volume(df_merged['成交量'].to_numpy()))
+        ]
 
-    st.subheader(f"📊 截至 {pd.Timestamp.now(tz='Asia/Shanghai').strftime('%Y-%m-%d %H:%M:%S')} 的实时表现")
-    col1, col2 = st.columns([1, 2])
+        st.subheader(f"📊 截至 {pd.Timestamp.now(tz='Asia/Shanghai').strftime('%Y-%m-%d %H:%M:%S')} 的实时表现")
+        # 只排序一次，领涨/领跌指标与条形图共用同一份结果
+        df_sorted_perf = df_merged.sort_values(by="涨跌幅 (%)")
+        col1, col2 = st.columns([1, 2])
     
-    with col1:
-        try:
-            df_sorted_perf = df_merged.sort_values(by="涨跌幅 (%)", ascending=False).dropna(subset=['涨跌幅 (%)'])
-            if not df_sorted_perf.empty:
-                top_performer = df_sorted_perf.iloc[0]
-                bottom_performer = df_sorted_perf.iloc[-1]
-                st.metric(label=f"🟢 领涨: {top_performer['板块']}", value=f"{top_performer['涨跌幅 (%)']:.2f}%", delta=f"{top_performer['涨跌额']:.2f}")
-                st.metric(label=f"🔴 领跌: {bottom_performer['板块']}", value=f"{bottom_performer['涨跌幅 (%)']:.2f}%", delta=f"{bottom_performer['涨跌额']:.2f}")
-        except (IndexError, KeyError): pass
-
-    with col2:
-        df_sorted_for_chart = df_merged.sort_values(by="涨跌幅 (%)")
-
-        # [核心修改] 使用更强大的 go.Figure() 来创建图表，以实现更精细的控制
-        fig_bar = go.Figure()
-
-        # 分别为上涨和下跌的板块添加条形
-        for index, row in df_sorted_for_chart.iterrows():
-            is_positive = row['涨跌幅 (%)'] >= 0
-            color = 'green' if is_positive else 'red'
-            
-            fig_bar.add_trace(go.Bar(
-                y=[row['板块']],
-                x=[row['涨跌幅 (%)']],
-                name=row['板块'],
-                orientation='h',
-                marker_color=color,
-                text=row['chart_text'],
-                textposition='inside', # 文本位置在条形内部
-                textfont=dict(color='white'),
-                insidetextanchor='end' if is_positive else 'start' # 上涨时文本靠右，下跌时文本靠左
-            ))
-        
-        # [核心修改] 更新图表布局
-        fig_bar.update_layout(
-            title_text="各板块实时涨跌幅与成交量对比",
-            showlegend=False,
-            barmode='stack', # 确保条形图正确堆叠（虽然这里只有一个）
-            yaxis={'categoryorder':'total ascending'},
-            xaxis_title="涨跌幅 (%)",
-            yaxis_title="板块",
-            margin=dict(l=150, r=20, t=80, b=50) # 优化边距
-        )
-        st.plotly_chart(fig_bar, use_container_width=True)
+        with col1:
+            try:
+                df_valid_perf = df_sorted_perf.dropna(subset=['涨跌幅 (%)'])
+                if not df_valid_perf.empty:
+                    top_performer = df_valid_perf.iloc[-1]
+                    bottom_performer = df_valid_perf.iloc[0]
+                    st.metric(label=f"🟢 领涨: {top_performer['板块']}", value=f"{top_performer['涨跌幅 (%)']:.2f}%", delta=f"{top_performer['涨跌额']:.2f}")
+                    st.metric(label=f"🔴 领跌: {bottom_performer['板块']}", value=f"{bottom_performer['涨跌幅 (%)']:.2f}%", delta=f"{bottom_performer['涨跌额']:.2f}")
+            except (IndexError, KeyError): pass
+
+        with col2:
+            # 条形内已显示数值，关闭悬停和工具栏以静态方式渲染
+            chart_rows = tuple(zip(df_sorted_perf['板块'], df_sorted_perf['涨跌幅 (%)'], df_sorted_perf['chart_text']))
+            st.plotly_chart(build_perf_bar(chart_rows), use_container_width=True, config={'staticPlot': True, 'displayModeBar': False})
+
+render_realtime(selected_sectors)